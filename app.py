@@ -1,7 +1,12 @@
 import streamlit as st
-import os
-import tempfile
-from markitdown import MarkItDown
+import io
+import pandas as pd
+import threading
+import xxhash
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import PurePath
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- Configuration & UI Setup ---
 st.set_page_config(
@@ -22,48 +27,130 @@ tab1, tab2 = st.tabs(["📤 Upload & Convert", "📊 File Size Comparison"])
 # --- The "Engine" Setup ---
 @st.cache_resource
 def get_engine():
+    # Imported here so the heavy converter stack loads once, on first upload
+    from markitdown import MarkItDown
     return MarkItDown()
 
-md_engine = get_engine()
+# Longer previews are truncated so the browser isn't handed multi-MB strings
+PREVIEW_CHARS = 32 * 1024
 
 # --- Helper Functions ---
+class ConversionError(Exception):
+    """A file could not be converted; raised in place of backend-specific errors."""
+
+class UnsupportedFileError(ConversionError):
+    """No converter accepts the file's format."""
+
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
 def format_size(size_in_bytes):
     """Converts bytes to readable KB/MB string."""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size_in_bytes < 1024:
-            return f"{size_in_bytes:.2f} {unit}"
-        size_in_bytes /= 1024
-    return f"{size_in_bytes:.2f} TB"
+    # bit_length picks the 1024-power directly instead of dividing in a loop
+    idx = min((max(size_in_bytes, 1).bit_length() - 1) // 10, len(SIZE_UNITS) - 1)
+    return f"{size_in_bytes / (1 << (idx * 10)):.2f} {SIZE_UNITS[idx]}"
 
-def process_file(uploaded_file):
-    """
-    Saves uploaded file to temp path, converts, and returns text + path cleanup.
-    """
-    try:
-        suffix = os.path.splitext(uploaded_file.name)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            tmp_file.write(uploaded_file.getbuffer())
-            tmp_path = tmp_file.name
+@dataclass(frozen=True)
+class FileMeta:
+    """Per-upload fields derived once per run and reused by every later step."""
+    name: str
+    base: str
+    ext: str
+    size: int
+    content_hash: str
+
+    @classmethod
+    def from_upload(cls, uploaded_file):
+        path = PurePath(uploaded_file.name)
+        return cls(
+            name=uploaded_file.name,
+            base=path.stem,
+            ext=path.suffix,
+            size=uploaded_file.size,
+            # Fast xxh128 digest of the upload, used as the conversion cache key
+            content_hash=xxhash.xxh128(uploaded_file.getbuffer()).hexdigest(),
+        )
+
+def utf8_size(text, chunk_size=64 * 1024):
+    """Returns the UTF-8 size of text without encoding it all at once."""
+    if text.isascii():
+        return len(text)
+    return sum(
+        len(text[i:i + chunk_size].encode('utf-8'))
+        for i in range(0, len(text), chunk_size)
+    )
+
+# PyMuPDF is not thread-safe, and its work is GIL-bound anyway, so PDF
+# conversions run one at a time. The lock is cached like the engine so it
+# is shared by every rerun and session in the process.
+@st.cache_resource
+def _pdf_lock():
+    return threading.Lock()
+
+def _convert_pdf(data):
+    """Converts PDF bytes with PyMuPDF4LLM, which is several times faster than PDFMiner."""
+    # Imported here so non-PDF uploads never pay for loading PyMuPDF
+    import pymupdf
+    import pymupdf4llm
+
+    with _pdf_lock():
+        try:
+            doc = pymupdf.open(stream=data, filetype="pdf")
+        except pymupdf.FileDataError as e:
+            raise ConversionError(str(e)) from e
+
+        with doc:
+            if doc.needs_pass:
+                raise ConversionError("PDF is encrypted")
+            try:
+                return pymupdf4llm.to_markdown(doc)
+            except Exception as e:
+                # pymupdf4llm has no error types of its own; malformed PDFs
+                # surface as arbitrary exceptions from deep in its layout code
+                raise ConversionError(str(e)) from e
+
+def _convert_markitdown(data, suffix):
+    """Converts Office and HTML bytes with MarkItDown."""
+    engine = get_engine()
+    from markitdown import MarkItDownException, UnsupportedFormatException
 
-        # Convert
-        result = md_engine.convert(tmp_path)
-        converted_text = result.text_content
+    try:
+        # Pass the known extension so MarkItDown doesn't have to guess the format
+        result = engine.convert_stream(io.BytesIO(data), file_extension=suffix)
+    except UnsupportedFormatException as e:
+        raise UnsupportedFileError(str(e)) from e
+    except MarkItDownException as e:
+        raise ConversionError(str(e)) from e
+    return result.text_content
 
-        # Cleanup
-        os.remove(tmp_path)
-        
-        return converted_text
+@st.cache_data(show_spinner=False, max_entries=64, ttl=24 * 60 * 60)
+def _convert_bytes(key, _data, suffix):
+    """
+    Converts file bytes in memory, without a temp file round-trip.
+    Returns the text and its UTF-8 size, both cached on the content hash
+    `key` so reruns and re-uploads skip the parse and the re-encode.
+    The leading underscore keeps Streamlit from hashing `_data` again.
+    """
+    if suffix.lower() == '.pdf':
+        text_content = _convert_pdf(_data)
+    else:
+        text_content = _convert_markitdown(_data, suffix)
+    return text_content, utf8_size(text_content)
 
-    except Exception as e:
-        if 'tmp_path' in locals() and os.path.exists(tmp_path):
-            os.remove(tmp_path)
-        raise e
+def process_file(key, data, suffix):
+    """
+    Converts file bytes to text, returning (text, converted size in bytes).
+    Touches no Streamlit state, so it is safe to run from worker threads.
+    """
+    return _convert_bytes(key, data, suffix)
 
 # --- Main App Logic ---
 
-# Initialize session state for stats if not present
+# Initialize session state if not present. Both dicts are keyed by content
+# hash, so reruns reuse earlier conversions instead of re-parsing them.
 if 'file_stats' not in st.session_state:
-    st.session_state['file_stats'] = []
+    st.session_state['file_stats'] = {}
+if 'conversions' not in st.session_state:
+    st.session_state['conversions'] = {}
 
 with tab1:
     uploaded_files = st.file_uploader(
@@ -72,94 +159,158 @@ with tab1:
         type=['docx', 'xlsx', 'pptx', 'pdf', 'html', 'htm']
     )
 
+    file_stats = st.session_state['file_stats']
+    conversions = st.session_state['conversions']
+    current_keys = []
+
     if uploaded_files:
         st.markdown("---")
-        
-        # Clear old stats when new upload happens to avoid duplicates
-        current_stats = []
-        
-        for uploaded_file in uploaded_files:
-            with st.expander(f"Processing: {uploaded_file.name}", expanded=True):
-                try:
-                    with st.spinner("Converting..."):
-                        text_content = process_file(uploaded_file)
-                        
-                        # --- Logic for File Size Stats ---
-                        original_size = uploaded_file.size
-                        # Estimate text size in bytes (UTF-8)
-                        converted_size = len(text_content.encode('utf-8'))
-                        
-                        # Calculate reduction
-                        if original_size > 0:
-                            reduction = (1 - (converted_size / original_size)) * 100
-                        else:
-                            reduction = 0
-                            
-                        stat_entry = {
-                            "File Name": uploaded_file.name,
-                            "Original Size": format_size(original_size),
-                            "Converted Size": format_size(converted_size),
-                            "Reduction": f"{reduction:.1f}% smaller"
-                        }
-                        current_stats.append(stat_entry)
-
-                    # --- Preview ---
-                    st.subheader("Preview")
-                    st.text_area(
-                        label="Converted Text",
-                        value=text_content,
-                        height=300,
-                        label_visibility="collapsed"
+
+        # Convert all files concurrently. Each file gets a placeholder in upload
+        # order that is filled in as soon as its own conversion finishes.
+        # Workers share the script's run context so cached calls work there.
+        with ThreadPoolExecutor(
+            max_workers=min(8, len(uploaded_files)),
+            initializer=add_script_run_ctx,
+            initargs=(None, get_script_run_ctx())
+        ) as executor:
+            futures = {}
+            for index, uploaded_file in enumerate(uploaded_files):
+                meta = FileMeta.from_upload(uploaded_file)
+                current_keys.append(meta.content_hash)
+                placeholder = st.empty()
+                if meta.content_hash in conversions:
+                    # Already converted (or already failed) on an earlier
+                    # run: hand back the stored result
+                    future = Future()
+                    cached = conversions[meta.content_hash]
+                    if cached == 'unsupported':
+                        future.set_exception(UnsupportedFileError())
+                    elif cached == 'failed':
+                        future.set_exception(ConversionError())
+                    else:
+                        future.set_result(cached)
+                else:
+                    placeholder.info(f"⏳ Converting {meta.name}...")
+                    # The bytes are only copied out for files that need converting
+                    future = executor.submit(
+                        process_file,
+                        meta.content_hash,
+                        uploaded_file.getvalue(),
+                        meta.ext,
                     )
+                futures[future] = (index, meta, placeholder)
 
-                    # --- Download Options ---
-                    base_name = os.path.splitext(uploaded_file.name)[0]
-                    download_name = f"{base_name}_converted"
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.download_button(
-                            label="⬇️ Download Markdown (.md)",
-                            data=text_content,
-                            file_name=f"{download_name}.md",
-                            mime="text/markdown"
-                        )
-                    
-                    with col2:
-                        st.download_button(
-                            label="⬇️ Download Text (.txt)",
-                            data=text_content,
-                            file_name=f"{download_name}.txt",
-                            mime="text/plain"
+            for future in as_completed(futures):
+                index, meta, placeholder = futures[future]
+                with placeholder.container(), st.expander(f"Processing: {meta.name}", expanded=True):
+                    try:
+                        text_content, converted_size = future.result()
+                        conversions[meta.content_hash] = (text_content, converted_size)
+
+                        # --- Logic for File Size Stats ---
+                        if meta.content_hash not in file_stats:
+                            file_stats[meta.content_hash] = {
+                                "File Name": meta.name,
+                                "Original Size": meta.size,
+                                "Converted Size": converted_size,
+                            }
+
+                        # --- Preview ---
+                        st.subheader("Preview")
+                        preview = text_content
+                        if len(text_content) > PREVIEW_CHARS:
+                            show_full = st.checkbox(
+                                "Show full text",
+                                # Names can repeat across uploads; hash + position can't
+                                key=f"show_full_{meta.content_hash}_{index}"
+                            )
+                            if not show_full:
+                                preview = text_content[:PREVIEW_CHARS]
+                                st.caption(f"Showing the first {PREVIEW_CHARS:,} characters.")
+                        st.text_area(
+                            label="Converted Text",
+                            value=preview,
+                            height=300,
+                            label_visibility="collapsed"
                         )
-                        
-                except Exception as e:
-                    st.error(f"⚠️ Could not read {uploaded_file.name}. Please check the format.")
-                    
-        # Update session state with new stats
-        st.session_state['file_stats'] = current_stats
+
+                        # --- Download Options ---
+                        download_name = f"{meta.base}_converted"
+                        # Encode once and share the bytes between both buttons
+                        payload = text_content.encode('utf-8')
+                        col1, col2 = st.columns(2)
+
+                        with col1:
+                            st.download_button(
+                                label="⬇️ Download Markdown (.md)",
+                                data=payload,
+                                file_name=f"{download_name}.md",
+                                mime="text/markdown"
+                            )
+
+                        with col2:
+                            st.download_button(
+                                label="⬇️ Download Text (.txt)",
+                                data=payload,
+                                file_name=f"{download_name}.txt",
+                                mime="text/plain"
+                            )
+
+                    except (ConversionError, OSError) as e:
+                        # Remember the failure as a plain marker so reruns don't
+                        # re-parse a file that is known to fail. Neither the
+                        # exception (its frames hold the upload bytes) nor its
+                        # class (redefined on every rerun) is kept across runs.
+                        unsupported = isinstance(e, UnsupportedFileError)
+                        conversions[meta.content_hash] = 'unsupported' if unsupported else 'failed'
+                        if unsupported:
+                            st.error(f"⚠️ {meta.name} is not a supported format.")
+                        else:
+                            st.error(f"⚠️ Could not read {meta.name}. Please check the format.")
+
+    # Keep entries in upload order rather than completion order, dropping
+    # files that are no longer uploaded (everything once the uploader is cleared)
+    st.session_state['conversions'] = {
+        key: conversions[key] for key in current_keys if key in conversions
+    }
+    st.session_state['file_stats'] = {
+        key: file_stats[key] for key in current_keys if key in file_stats
+    }
 
 # --- Tab 2: Comparison ---
 with tab2:
     st.header("File Size Savings")
     
     if st.session_state['file_stats']:
-        for stat in st.session_state['file_stats']:
-            # Create a clean UI for each file
-            st.markdown(f"### 📄 {stat['File Name']}")
-            
-            # Create columns for the metrics
-            col_a, col_b, col_c = st.columns(3)
-            
-            with col_a:
-                st.metric("Original File Size", stat['Original Size'])
-            
-            with col_b:
-                st.metric("Converted .txt Size", stat['Converted Size'])
-                
-            with col_c:
-                st.metric("Efficiency", stat['Reduction'], delta_color="normal")
-            
-            st.divider()
+        # One table for all files instead of a row of widgets per file
+        df = pd.DataFrame(list(st.session_state['file_stats'].values()))
+        original = df['Original Size']
+        converted = df['Converted Size']
+        df['Reduction'] = (1 - converted / original.where(original > 0)).fillna(0) * 100
+
+        # Summary across all files
+        col_a, col_b, col_c = st.columns(3)
+
+        with col_a:
+            st.metric("Original File Size", format_size(int(original.sum())))
+
+        with col_b:
+            st.metric("Converted .txt Size", format_size(int(converted.sum())))
+
+        with col_c:
+            st.metric("Efficiency", f"{df['Reduction'].mean():.1f}% smaller", delta_color="normal")
+
+        st.dataframe(
+            df.assign(
+                **{
+                    "Original Size": original.map(lambda n: format_size(int(n))),
+                    "Converted Size": converted.map(lambda n: format_size(int(n))),
+                    "Reduction": df['Reduction'].map("{:.1f}% smaller".format),
+                }
+            ),
+            width="stretch",
+            hide_index=True
+        )
     else:
         st.info("Upload and convert files in the first tab to see size comparisons here.")